@@ -1,7 +1,10 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+# Worker processes inherit the parent's environment, so only parse .env once
+if not os.environ.get("_ENV_LOADED"):
+    load_dotenv()
+    os.environ["_ENV_LOADED"] = "1"
 
 # API Configuration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
@@ -11,12 +14,24 @@ OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 # File Configuration
 # UPLOAD_FOLDER removed - no longer storing uploaded files
 DOCUMENTS_STORAGE_FOLDER = os.getenv("DOCUMENTS_STORAGE_FOLDER", "documents_storage")
+# Each document is one file: a fixed-size metadata header followed by content
+DOCUMENT_FILE_SUFFIX = ".qr"
+METADATA_HEADER_SIZE = 4096
+# Even fully JSON-escaped (6 bytes per byte), a name this long fits in the header
+MAX_FILENAME_BYTES = 255
+# Listings with more document files than this read their headers in a thread pool
+PARALLEL_LISTING_MIN_FILES = 16
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 52428800))  # 50MB default
-ALLOWED_EXTENSIONS = {'.pdf', '.txt', '.docx', '.xlsx', '.zip'}
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Read uploads 1MB at a time
+ALLOWED_EXTENSIONS = frozenset({'.pdf', '.txt', '.docx', '.xlsx', '.zip'})
+# Number of documents whose prompt-sized text excerpt is kept in memory for queries
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", 128))
 
 # Create storage folder for metadata and extracted content only
 os.makedirs(DOCUMENTS_STORAGE_FOLDER, exist_ok=True)
 
 # Model Configuration
 CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 100
\ No newline at end of file
+CHUNK_OVERLAP = 100
+# Maximum characters of document text included in an LLM prompt
+MAX_DOCUMENT_CHARS = int(os.getenv("MAX_DOCUMENT_CHARS", 8000))
\ No newline at end of file
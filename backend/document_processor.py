@@ -1,21 +1,26 @@
+import codecs
 import io
 import zipfile
-import PyPDF2
+import fitz  # PyMuPDF
 from docx import Document as DocxDocument
 from openpyxl import load_workbook
 
+def _stringify(cell) -> str:
+    """Render a spreadsheet cell value, treating empty cells as blank"""
+    return "" if cell is None else str(cell)
+
 class DocumentProcessor:
     """Process various document formats and extract text from memory (no file storage)"""
     
     @staticmethod
     def process_pdf(file_bytes: bytes) -> str:
         """Extract text from PDF bytes"""
-        text = ""
         try:
-            pdf_file = io.BytesIO(file_bytes)
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+            doc = fitz.open(stream=file_bytes, filetype="pdf")
+            try:
+                text = "\n".join(page.get_text("text") for page in doc)
+            finally:
+                doc.close()
         except Exception as e:
             raise Exception(f"Error processing PDF: {str(e)}")
         return text
@@ -23,6 +28,12 @@ class DocumentProcessor:
     @staticmethod
     def process_txt(file_bytes: bytes) -> str:
         """Extract text from TXT bytes"""
+        # A byte order mark identifies the encoding without a trial decode
+        if file_bytes.startswith(codecs.BOM_UTF8):
+            return file_bytes[len(codecs.BOM_UTF8):].decode('utf-8', 'replace')
+        if file_bytes.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return file_bytes.decode('utf-16', 'replace')
+        
         try:
             text = file_bytes.decode('utf-8')
         except UnicodeDecodeError:
@@ -35,92 +46,113 @@ class DocumentProcessor:
     @staticmethod
     def process_docx(file_bytes: bytes) -> str:
         """Extract text from DOCX bytes"""
-        text = ""
         try:
             docx_file = io.BytesIO(file_bytes)
             doc = DocxDocument(docx_file)
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        text += cell.text + " "
-                text += "\n"
+            parts = [paragraph.text for paragraph in doc.paragraphs]
+            parts.extend(
+                " ".join(cell.text for cell in row.cells)
+                for table in doc.tables
+                for row in table.rows
+            )
         except Exception as e:
             raise Exception(f"Error processing DOCX: {str(e)}")
-        return text
+        return "\n".join(parts)
 
     @staticmethod
     def process_xlsx(file_bytes: bytes) -> str:
         """Extract text from XLSX bytes"""
-        text = ""
+        parts = []
         try:
             xlsx_file = io.BytesIO(file_bytes)
-            workbook = load_workbook(xlsx_file)
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text += f"\n=== Sheet: {sheet_name} ===\n"
-                for row in sheet.iter_rows(values_only=True):
-                    text += " | ".join(str(cell) if cell is not None else "" for cell in row) + "\n"
+            # read_only streams rows without building the full cell model
+            workbook = load_workbook(xlsx_file, read_only=True, data_only=True)
+            try:
+                for sheet_name in workbook.sheetnames:
+                    sheet = workbook[sheet_name]
+                    parts.append(f"\n=== Sheet: {sheet_name} ===")
+                    parts.extend([" | ".join(map(_stringify, row)) for row in sheet.iter_rows(values_only=True)])
+            finally:
+                # Read-only workbooks keep the archive open until closed
+                workbook.close()
         except Exception as e:
             raise Exception(f"Error processing XLSX: {str(e)}")
-        return text
+        return "\n".join(parts)
 
     @staticmethod
-    def process_zip(file_bytes: bytes) -> dict:
-        """Extract and process files from ZIP bytes"""
-        contents = {}
+    def process_zip_member(file_ext: str, file_bytes: bytes) -> str:
+        """Extract text from a single ZIP member"""
+        handler = _FORMAT_HANDLERS.get(file_ext)
+        if handler is None:
+            # For unsupported formats, store as text representation
+            return f"[Unsupported file type: .{file_ext}]"
+        try:
+            return handler(file_bytes)
+        except Exception as e:
+            return f"[Error processing file: {str(e)}]"
+
+    @staticmethod
+    def read_zip_members(file_bytes: bytes) -> list:
+        """Read (filename, extension, bytes) for each file in ZIP bytes"""
+        members = []
         try:
             zip_file = io.BytesIO(file_bytes)
+            # ZipFile handles aren't safe for concurrent reads, so every member is
+            # read up front and only the decoding is handed out
             with zipfile.ZipFile(zip_file, 'r') as zip_ref:
                 for file_info in zip_ref.filelist:
-                    # Skip directories
-                    if file_info.filename.endswith('/'):
+                    # Skip directories, macOS resource forks and empty entries
+                    if (file_info.filename.endswith('/')
+                            or file_info.filename.startswith('__MACOSX/')
+                            or file_info.file_size == 0):
                         continue
                     
                     # Get file extension
                     file_ext = file_info.filename.lower().split('.')[-1] if '.' in file_info.filename else ''
                     
-                    # Read file content from ZIP
-                    file_content = zip_ref.read(file_info.filename)
-                    
-                    # Process based on extension
-                    try:
-                        if file_ext == 'pdf':
-                            contents[file_info.filename] = DocumentProcessor.process_pdf(file_content)
-                        elif file_ext == 'txt':
-                            contents[file_info.filename] = DocumentProcessor.process_txt(file_content)
-                        elif file_ext == 'docx':
-                            contents[file_info.filename] = DocumentProcessor.process_docx(file_content)
-                        elif file_ext == 'xlsx':
-                            contents[file_info.filename] = DocumentProcessor.process_xlsx(file_content)
-                        else:
-                            # For unsupported formats, store as text representation
-                            contents[file_info.filename] = f"[Unsupported file type: .{file_ext}]"
-                    except Exception as e:
-                        contents[file_info.filename] = f"[Error processing file: {str(e)}]"
+                    # Read file content from ZIP; unsupported members are never decompressed
+                    if file_ext in _FORMAT_HANDLERS:
+                        file_content = zip_ref.read(file_info)
+                    else:
+                        file_content = b""
+                    members.append((file_info.filename, file_ext, file_content))
                         
         except Exception as e:
             raise Exception(f"Error processing ZIP: {str(e)}")
-        return contents
+        return members
+
+    @staticmethod
+    def process_zip(file_bytes: bytes) -> dict:
+        """Extract and process files from ZIP bytes"""
+        return {
+            filename: DocumentProcessor.process_zip_member(file_ext, file_content)
+            for filename, file_ext, file_content in DocumentProcessor.read_zip_members(file_bytes)
+        }
+
+    @staticmethod
+    def build_zip_result(contents: dict) -> dict:
+        """Combine per-member text into a processed ZIP document"""
+        # Flatten once here so queries don't rebuild the combined text
+        text = "\n\n".join(f"--- {filename} ---\n{content}" for filename, content in contents.items())
+        return {"content": text, "format": "zip", "files": list(contents.keys())}
 
     @staticmethod
     def process_document(file_bytes: bytes, file_extension: str) -> dict:
         """Process document bytes based on file type"""
-        if file_extension == '.pdf':
-            text = DocumentProcessor.process_pdf(file_bytes)
-            return {"content": text, "format": "pdf"}
-        elif file_extension == '.txt':
-            text = DocumentProcessor.process_txt(file_bytes)
-            return {"content": text, "format": "txt"}
-        elif file_extension == '.docx':
-            text = DocumentProcessor.process_docx(file_bytes)
-            return {"content": text, "format": "docx"}
-        elif file_extension == '.xlsx':
-            text = DocumentProcessor.process_xlsx(file_bytes)
-            return {"content": text, "format": "xlsx"}
-        elif file_extension == '.zip':
-            contents = DocumentProcessor.process_zip(file_bytes)
-            return {"content": contents, "format": "zip"}
-        else:
-            raise Exception(f"Unsupported file format: {file_extension}")
\ No newline at end of file
+        file_format = file_extension.lstrip('.')
+        if file_format == 'zip':
+            return DocumentProcessor.build_zip_result(DocumentProcessor.process_zip(file_bytes))
+        
+        try:
+            handler = _FORMAT_HANDLERS[file_format]
+        except KeyError:
+            raise Exception(f"Unsupported file format: {file_extension}")
+        return {"content": handler(file_bytes), "format": file_format}
+
+# Text extractors keyed by bare extension, shared by process_document and process_zip_member
+_FORMAT_HANDLERS = {
+    'pdf': DocumentProcessor.process_pdf,
+    'txt': DocumentProcessor.process_txt,
+    'docx': DocumentProcessor.process_docx,
+    'xlsx': DocumentProcessor.process_xlsx,
+}
\ No newline at end of file
@@ -1,7 +1,43 @@
 import aiohttp
-import json
+import orjson
 import re
-from config import OPENROUTER_API_KEY, OPENROUTER_BASE_URL, OPENROUTER_MODEL
+from config import OPENROUTER_API_KEY, OPENROUTER_BASE_URL, OPENROUTER_MODEL, MAX_DOCUMENT_CHARS
+
+# Common greeting patterns, fused into a single alternation
+_GREETING_RE = re.compile(
+    r"\b(?:hi|hello|hey|greetings|good\s+(?:morning|afternoon|evening)|howdy"
+    r"|how\s+are\s+you|what'?s\s+up|nice\s+to\s+meet|pleasure\s+to\s+meet)\b",
+    re.IGNORECASE
+)
+
+# Zero-width and control characters stripped from responses via str.translate
+_DELETE_TBL = dict.fromkeys(
+    [*range(0x00, 0x09), 0x0B, 0x0C, *range(0x0E, 0x20), 0x7F, 0x200B, 0x200C, 0x200D, 0xFEFF],
+    None
+)
+
+# Response cleanup patterns, compiled once at import
+_ESC_RE = re.compile(r'\\(?:x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|[rnt])')
+_HTML_RE = re.compile(r'<[^>]+>')
+_CODEFENCE_RE = re.compile(r'^```[\w]*\n?|\n?```$', re.MULTILINE)
+
+# Static parts of the document prompt; only the document and question vary
+_PROMPT_PREFIX = """You are a helpful document analysis assistant. Analyze the following document and answer the user's question.
+
+<document>
+"""
+_PROMPT_MIDDLE = """
+</document>
+
+User Question: """
+_PROMPT_SUFFIX = """
+
+Instructions:
+- Provide a clear, direct answer based ONLY on the document content
+- Be concise but complete
+- If the information is not in the document, politely say so
+- Use proper formatting with paragraphs for readability
+- Do not include any special characters, escape sequences, or formatting markers"""
 
 class LLMHandler:
     """Handle communication with OpenRouter API"""
@@ -10,15 +46,15 @@ class LLMHandler:
         self.api_key = OPENROUTER_API_KEY
         self.base_url = OPENROUTER_BASE_URL
         self.model = OPENROUTER_MODEL
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "HTTP-Referer": "http://localhost:8000",
+            "X-Title": "Document Assistant",
+            "Content-Type": "application/json"
+        }
         
-        # Common greeting patterns
-        self.greeting_patterns = [
-            r'\b(hi|hello|hey|greetings|good\s+(morning|afternoon|evening)|howdy)\b',
-            r'\bhow\s+are\s+you\b',
-            r'\bwhat\'?s\s+up\b',
-            r'\bnice\s+to\s+meet\b',
-            r'\bpleasure\s+to\s+meet\b'
-        ]
+        # Shared connection pool, opened and closed by the app lifespan
+        self.session = None
     
     def is_greeting(self, text: str) -> bool:
         """
@@ -34,9 +70,7 @@ class LLMHandler:
         
         # Check if text is very short and matches greeting patterns
         if len(text_lower.split()) <= 5:  # Short messages are more likely greetings
-            for pattern in self.greeting_patterns:
-                if re.search(pattern, text_lower, re.IGNORECASE):
-                    return True
+            return _GREETING_RE.search(text_lower) is not None
         
         return False
     
@@ -69,42 +103,37 @@ Just ask your question, and I'll do my best to help based on the document conten
         """
         try:
             # Remove zero-width characters and control characters
-            content = re.sub(r'[\u200B-\u200D\uFEFF\x00-\x08\x0B-\x0C\x0E-\x1F\x7F]', '', content)
+            content = content.translate(_DELETE_TBL)
             
-            # Remove common problematic escape sequences
-            content = re.sub(r'\\x[0-9a-fA-F]{2}', '', content)
-            content = re.sub(r'\\u[0-9a-fA-F]{4}', '', content)
-            content = re.sub(r'\\[rnt]', '', content)
+            # Remove common problematic escape sequences (\xNN, \uNNNN, \r, \n, \t)
+            content = _ESC_RE.sub('', content)
             
             # Remove HTML tags if any
-            content = re.sub(r'<[^>]+>', '', content)
+            content = _HTML_RE.sub('', content)
             
             # Remove markdown code block markers if they appear incorrectly
-            content = re.sub(r'^```[\w]*\n?', '', content, flags=re.MULTILINE)
-            content = re.sub(r'\n?```$', '', content, flags=re.MULTILINE)
+            content = _CODEFENCE_RE.sub('', content)
             
-            # Clean up multiple spaces while preserving intentional formatting
-            lines = content.split('\n')
+            # Clean up multiple spaces and excessive blank lines in a single pass
             cleaned_lines = []
-            for line in lines:
-                # Preserve empty lines but clean content lines
-                if line.strip():
-                    cleaned_line = re.sub(r' +', ' ', line.strip())
+            blank_run = 0
+            for line in content.split('\n'):
+                cleaned_line = ' '.join(line.split())
+                if cleaned_line:
+                    blank_run = 0
                     cleaned_lines.append(cleaned_line)
                 else:
-                    cleaned_lines.append('')
-            
-            content = '\n'.join(cleaned_lines)
+                    # Keep at most one empty line (two consecutive newlines)
+                    blank_run += 1
+                    if blank_run == 1:
+                        cleaned_lines.append('')
             
-            # Remove excessive blank lines (more than 2 consecutive)
-            content = re.sub(r'\n{3,}', '\n\n', content)
-            
-            return content.strip()
+            return '\n'.join(cleaned_lines).strip()
         except Exception as e:
             print(f"Error cleaning response: {str(e)}")
             return content.strip()
 
-    async def query_document(self, document_content: str, question: str, temperature: float = 0.7) -> str:
+    async def query_document(self, document_content: str, question: str, temperature: float = 0.7, max_chars: int = MAX_DOCUMENT_CHARS) -> str:
         """
         Query the document using LLM
         
@@ -112,6 +141,7 @@ Just ask your question, and I'll do my best to help based on the document conten
             document_content: The extracted document content
             question: User's question
             temperature: Temperature for model response
+            max_chars: Maximum number of document characters sent to the model
             
         Returns:
             Model's response
@@ -120,31 +150,26 @@ Just ask your question, and I'll do my best to help based on the document conten
         if self.is_greeting(question):
             return self.get_greeting_response()
         
+        return await self._complete(document_content, question, temperature, max_chars)
+
+    async def _complete(self, document_content: str, question: str, temperature: float, max_chars: int) -> str:
+        """
+        Send the document prompt to the LLM (greeting detection is done by the callers)
+        
+        Args:
+            document_content: The extracted document content
+            question: User's question
+            temperature: Temperature for model response
+            max_chars: Maximum number of document characters sent to the model
+            
+        Returns:
+            Model's response
+        """
         if not self.api_key:
             raise Exception("OpenRouter API key not configured")
         
         # Prepare the prompt with better instructions
-        prompt = f"""You are a helpful document analysis assistant. Analyze the following document and answer the user's question.
-
-<document>
-{document_content[:8000]}
-</document>
-
-User Question: {question}
-
-Instructions:
-- Provide a clear, direct answer based ONLY on the document content
-- Be concise but complete
-- If the information is not in the document, politely say so
-- Use proper formatting with paragraphs for readability
-- Do not include any special characters, escape sequences, or formatting markers"""
-
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "HTTP-Referer": "http://localhost:8000",
-            "X-Title": "Document Assistant",
-            "Content-Type": "application/json"
-        }
+        prompt = "".join((_PROMPT_PREFIX, document_content[:max_chars], _PROMPT_MIDDLE, question, _PROMPT_SUFFIX))
 
         payload = {
             "model": self.model,
@@ -155,31 +180,32 @@ Instructions:
             "max_tokens": 2000
         }
 
+        if self.session is None:
+            raise Exception("HTTP session not initialized")
+
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/chat/completions",
-                    json=payload,
-                    headers=headers,
-                    timeout=aiohttp.ClientTimeout(total=60)
-                ) as response:
-                    if response.status != 200:
-                        error_text = await response.text()
-                        raise Exception(f"OpenRouter API error: {error_text}")
-                    
-                    data = await response.json()
-                    raw_response = data['choices'][0]['message']['content']
-                    
-                    # Clean the response before returning
-                    cleaned_response = self.clean_response(raw_response)
-                    return cleaned_response
+            async with self.session.post(
+                f"{self.base_url}/chat/completions",
+                data=orjson.dumps(payload),
+                headers=self.headers
+            ) as response:
+                if response.status != 200:
+                    error_text = await response.text()
+                    raise Exception(f"OpenRouter API error: {error_text}")
+                
+                data = orjson.loads(await response.read())
+                raw_response = data['choices'][0]['message']['content']
+                
+                # Clean the response before returning
+                cleaned_response = self.clean_response(raw_response)
+                return cleaned_response
                     
         except aiohttp.ClientError as e:
             raise Exception(f"Error communicating with OpenRouter API: {str(e)}")
         except Exception as e:
             raise Exception(f"Error querying LLM: {str(e)}")
 
-    async def query_with_context(self, document_content: str, question: str, context: str = "", temperature: float = 0.7) -> str:
+    async def query_with_context(self, document_content: str, question: str, context: str = "", temperature: float = 0.7, max_chars: int = MAX_DOCUMENT_CHARS) -> str:
         """
         Query with additional context
         
@@ -188,13 +214,14 @@ Instructions:
             question: User's question
             context: Additional context
             temperature: Temperature for model response
+            max_chars: Maximum number of document characters sent to the model
             
         Returns:
             Model's response
         """
-        # Check if it's a greeting
+        # Check if it's a greeting before building the prompt
         if self.is_greeting(question):
             return self.get_greeting_response()
         
-        full_content = f"{context}\n\nDocument Content:\n{document_content[:8000]}"
-        return await self.query_document(full_content, question, temperature)
\ No newline at end of file
+        full_content = f"{context}\n\nDocument Content:\n{document_content[:max_chars]}"
+        return await self._complete(full_content, question, temperature, max_chars)
\ No newline at end of file
@@ -1,14 +1,23 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from typing import Optional
+import asyncio
+import multiprocessing
+import os
 import traceback
+import aiohttp
 
-from config import MAX_FILE_SIZE, ALLOWED_EXTENSIONS
+from config import MAX_FILE_SIZE, MAX_FILENAME_BYTES, ALLOWED_EXTENSIONS, UPLOAD_CHUNK_SIZE
 from schemas import UploadResponse, QueryRequest, QueryResponse, ListDocumentsResponse, DocumentInfo
 from utils import (
-    generate_document_id, get_file_extension, is_allowed_file,
-    save_document_metadata, save_document_content, load_document_content,
-    load_document_metadata, list_all_documents, delete_document
+    generate_document_id, get_file_extension, is_allowed_file, matches_file_signature,
+    save_document, load_document_excerpt,
+    load_document_metadata, list_all_documents, count_documents, delete_document,
+    migrate_legacy_documents, format_upload_date
 )
 from document_processor import DocumentProcessor
 from llm_handler import LLMHandler
@@ -16,12 +25,70 @@ from llm_handler import LLMHandler
 # Initialize
 llm_handler = LLMHandler()
 
+# Worker processes for CPU-bound document parsing, created in lifespan
+_PARSE_POOL = None
+
+def _new_parse_pool() -> ProcessPoolExecutor:
+    """Create the parse pool without forking the threaded server process"""
+    # Forking copies whatever locks other threads held at that moment, so
+    # start workers from a clean process instead
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context(start_method))
+
+def _restart_parse_pool(broken_pool: ProcessPoolExecutor):
+    """Replace the parse pool after one of its workers died"""
+    global _PARSE_POOL
+    # Concurrent uploads may all see the same broken pool; only replace it once
+    if _PARSE_POOL is broken_pool:
+        broken_pool.shutdown(wait=False, cancel_futures=True)
+        _PARSE_POOL = _new_parse_pool()
+
+async def _run_in_parse_pool(fn, *args):
+    """Run fn in the parse pool, retrying once on a fresh pool if a worker dies"""
+    # A crash fails every task in flight on the pool, not just the one that
+    # caused it, so a single failure says nothing about this file
+    for _ in range(2):
+        parse_pool = _PARSE_POOL
+        try:
+            return await asyncio.get_running_loop().run_in_executor(parse_pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker crashed (parser fault or OOM kill); later uploads need a fresh pool
+            print(f"Parse pool broken: {traceback.format_exc()}")
+            _restart_parse_pool(parse_pool)
+    raise HTTPException(
+        status_code=422,
+        detail="Document could not be processed: the parser crashed on this file"
+    )
+
+async def _parse_zip(file_bytes) -> dict:
+    """Parse a ZIP upload with its members spread across the parse pool"""
+    # Decompression stays on one thread; each member is then decoded as its own
+    # pool task so an archive of many PDFs keeps every worker busy
+    members = await asyncio.to_thread(DocumentProcessor.read_zip_members, file_bytes)
+    texts = await asyncio.gather(*(
+        _run_in_parse_pool(DocumentProcessor.process_zip_member, file_ext, member_bytes)
+        for _, file_ext, member_bytes in members
+    ))
+    return DocumentProcessor.build_zip_result(dict(zip((filename for filename, _, _ in members), texts)))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    global _PARSE_POOL
     print("✓ FastAPI LLM Document Assistant started")
     print("✓ Security: In-Memory Processing - No local file storage")
     print("✓ Only metadata and extracted text are stored")
+    migrate_legacy_documents()
+    # Reuse one pooled session so LLM calls skip the TCP/TLS handshake
+    llm_handler.session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=60),
+        connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=75)
+    )
+    _PARSE_POOL = _new_parse_pool()
     yield
+    await llm_handler.session.close()
+    llm_handler.session = None
+    _PARSE_POOL.shutdown()
+    _PARSE_POOL = None
     print("✗ Application shutdown")
 
 app = FastAPI(
@@ -79,6 +146,13 @@ async def upload_document(file: UploadFile = File(...)):
         if not file.filename:
             raise HTTPException(status_code=400, detail="No file provided")
         
+        # Metadata lives in a fixed-size header, so bound the client-supplied name
+        if len(file.filename.encode('utf-8')) > MAX_FILENAME_BYTES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Filename too long. Max length: {MAX_FILENAME_BYTES} bytes"
+            )
+        
         file_extension = get_file_extension(file.filename)
         if not is_allowed_file(file.filename):
             raise HTTPException(
@@ -86,29 +160,42 @@ async def upload_document(file: UploadFile = File(...)):
                 detail=f"File type not allowed. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
             )
         
-        # Read file content into memory (NO FILE STORAGE)
-        file_content = await file.read()
+        # Read file content into memory in chunks (NO FILE STORAGE),
+        # rejecting oversized uploads as soon as the limit is crossed
+        buffer = bytearray()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            # Reject mislabeled files on the first chunk, before buffering the rest
+            if not buffer and not matches_file_signature(file_extension, chunk):
+                raise HTTPException(
+                    status_code=415,
+                    detail=f"File content does not match its {file_extension} extension"
+                )
+            buffer.extend(chunk)
+            if len(buffer) > MAX_FILE_SIZE:
+                max_size_mb = MAX_FILE_SIZE / (1024 * 1024)
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File too large. Max size: {max_size_mb:.1f}MB"
+                )
+        # The parsers accept any bytes-like object, so skip copying into bytes
+        file_content = buffer
         file_size = len(file_content)
         
-        # Check file size
-        if file_size > MAX_FILE_SIZE:
-            max_size_mb = MAX_FILE_SIZE / (1024 * 1024)
-            raise HTTPException(
-                status_code=413,
-                detail=f"File too large. Max size: {max_size_mb:.1f}MB"
-            )
-        
         # Generate document ID
         document_id = generate_document_id()
         
         # Process document directly from bytes in memory
         # Original file is NEVER saved to disk
-        result = DocumentProcessor.process_document(file_content, file_extension)
+        # Parsing runs in a worker process so the event loop stays responsive
+        if file_extension == '.zip':
+            result = await _parse_zip(file_content)
+        else:
+            result = await _run_in_parse_pool(DocumentProcessor.process_document, file_content, file_extension)
         
         # Save only metadata and extracted text content
         # Original file bytes are discarded after processing
-        save_document_metadata(document_id, file.filename, file_size)
-        save_document_content(document_id, result)
+        # Disk writes run on a worker thread so large content doesn't block the event loop
+        await asyncio.to_thread(save_document, document_id, file.filename, file_size, result)
         
         return UploadResponse(
             document_id=document_id,
@@ -127,21 +214,11 @@ async def upload_document(file: UploadFile = File(...)):
 async def query_document(request: QueryRequest):
     """Query a processed document with a question"""
     try:
-        # Load document content (extracted text only)
-        content_data = load_document_content(request.document_id)
-        if not content_data:
+        # Load the prompt-sized document text (extracted text only, cached across queries)
+        document_text = load_document_excerpt(request.document_id)
+        if document_text is None:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Get the text content
-        if content_data.get("format") == "zip":
-            # For ZIP files, combine all extracted contents
-            document_text = "\n\n".join(
-                [f"--- {filename} ---\n{content}" 
-                 for filename, content in content_data.get("content", {}).items()]
-            )
-        else:
-            document_text = content_data.get("content", "")
-        
         if not document_text:
             raise HTTPException(status_code=400, detail="Document has no extractable content")
         
@@ -166,23 +243,28 @@ async def query_document(request: QueryRequest):
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
 @app.get("/documents", response_model=ListDocumentsResponse)
-async def list_documents():
-    """List all processed documents (metadata only)"""
+async def list_documents(offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1)):
+    """List processed documents (metadata only), optionally paginated"""
     try:
-        documents = list_all_documents()
+        # Documents are read lazily, so a page stops reading files once it is full
+        stop = None if limit is None else offset + limit
+        documents = islice(list_all_documents(), offset, stop)
         document_list = []
         
+        # Metadata is written by this service, so skip per-instance validation
         for doc in documents:
-            document_list.append(DocumentInfo(
+            document_list.append(DocumentInfo.model_construct(
                 document_id=doc.get("document_id"),
                 filename=doc.get("filename"),
-                upload_date=doc.get("upload_date"),
+                upload_date=format_upload_date(doc),
                 file_size=doc.get("file_size", 0)
             ))
         
-        return ListDocumentsResponse(
+        # total counts all documents, not just this page, so clients can tell whether more pages exist
+        paginated = offset > 0 or limit is not None
+        return ListDocumentsResponse.model_construct(
             documents=document_list,
-            total=len(document_list)
+            total=count_documents() if paginated else len(document_list)
         )
     except Exception as e:
         print(f"List error: {traceback.format_exc()}")
@@ -201,7 +283,7 @@ async def delete_doc(document_id: str):
         if not metadata:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Delete metadata and extracted content JSON files only
+        # Delete the metadata and extracted content file only
         # No original files to delete (they were never stored)
         delete_document(document_id)
         
@@ -26,4 +26,4 @@ class DocumentInfo(BaseModel):
 
 class ListDocumentsResponse(BaseModel):
     documents: List[DocumentInfo]
-    total: int
\ No newline at end of file
+    total: int  # All stored documents, even when documents holds a single page
\ No newline at end of file
@@ -1,78 +1,346 @@
 import os
+import time
 import uuid
-import json
+import msgpack
+import orjson
+import zstandard
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from config import DOCUMENTS_STORAGE_FOLDER, ALLOWED_EXTENSIONS
+from config import (
+    DOCUMENTS_STORAGE_FOLDER, ALLOWED_EXTENSIONS, DOCUMENT_CACHE_SIZE, MAX_DOCUMENT_CHARS,
+    DOCUMENT_FILE_SUFFIX, METADATA_HEADER_SIZE, PARALLEL_LISTING_MIN_FILES
+)
+
+# Extensions are compared lowercased, so normalize the configured set once
+_ALLOWED_EXTENSIONS = frozenset(ext.lower() for ext in ALLOWED_EXTENSIONS)
+
+# Leading magic bytes per extension; DOCX and XLSX are ZIP containers
+_FILE_SIGNATURES = {
+    '.pdf': (b'%PDF-',),
+    '.docx': (b'PK\x03\x04',),
+    '.xlsx': (b'PK\x03\x04',),
+    '.zip': (b'PK\x03\x04', b'PK\x05\x06'),
+}
+
+# Storage paths only vary by document_id, so join the folder once at import
+_DOCUMENT_PATH_TEMPLATE = os.path.join(DOCUMENTS_STORAGE_FOLDER, "{}" + DOCUMENT_FILE_SUFFIX)
+
+# Leading byte identifying how a document's content section is encoded
+CONTENT_FORMAT_MSGPACK = b'\x01'
+
+# Content sections starting with the zstd frame magic are compressed
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+CONTENT_COMPRESSION_LEVEL = 3
+
+# Parsed metadata keyed by document_id, validated against the file's mtime
+_META_CACHE: dict[str, tuple[int, dict]] = {}
+
+# Prompt-sized document text keyed by document_id as (mtime_ns, excerpt), in LRU order
+_EXCERPT_CACHE: OrderedDict[str, tuple[int, str]] = OrderedDict()
+
+# Bumped on every save/delete in this process; with the folder's mtime and
+# its document file names it decides whether the cached listing is current
+_generation = 0
+_list_cache = None
+
+def _invalidate_listing():
+    """Mark the cached document listing as stale"""
+    global _generation
+    _generation += 1
 
 def generate_document_id():
     """Generate unique document ID"""
-    return str(uuid.uuid4())
+    return uuid.uuid4().hex
 
 def get_file_extension(filename: str):
     """Get file extension"""
-    return os.path.splitext(filename)[1].lower()
+    return '.' + filename.rpartition('.')[2].lower() if '.' in filename else ''
 
 def is_allowed_file(filename: str):
     """Check if file extension is allowed"""
-    return get_file_extension(filename) in ALLOWED_EXTENSIONS
+    return get_file_extension(filename) in _ALLOWED_EXTENSIONS
+
+def matches_file_signature(file_extension: str, header: bytes):
+    """Check that the first bytes of a file match the magic number for its extension"""
+    signatures = _FILE_SIGNATURES.get(file_extension)
+    # Formats without a signature (plain text) can't be checked
+    return signatures is None or header.startswith(signatures)
 
-def get_metadata_path(document_id: str):
-    """Get metadata file path for document"""
-    return os.path.join(DOCUMENTS_STORAGE_FOLDER, f"{document_id}_metadata.json")
+def get_document_path(document_id: str):
+    """Get storage file path for document (metadata header followed by content)"""
+    return _DOCUMENT_PATH_TEMPLATE.format(document_id)
 
-def get_content_path(document_id: str):
-    """Get content file path for document"""
-    return os.path.join(DOCUMENTS_STORAGE_FOLDER, f"{document_id}_content.json")
+def _encode_content(content: dict):
+    """Serialize document content as zstd-compressed msgpack behind a format version byte"""
+    # Compressor objects are not thread-safe and saves run on worker threads
+    compressor = zstandard.ZstdCompressor(level=CONTENT_COMPRESSION_LEVEL)
+    return compressor.compress(CONTENT_FORMAT_MSGPACK + msgpack.packb(content, use_bin_type=True))
 
-def save_document_metadata(document_id: str, filename: str, file_size: int):
-    """Save document metadata"""
+def _decode_content(data: bytes):
+    """Deserialize document content, dispatching on its format version byte"""
+    if data.startswith(_ZSTD_MAGIC):
+        data = zstandard.ZstdDecompressor().decompress(data)
+    if data[:1] == CONTENT_FORMAT_MSGPACK:
+        return msgpack.unpackb(memoryview(data)[1:], raw=False)
+    # Content written before versioning is plain JSON
+    return orjson.loads(data)
+
+def _write_document(document_id: str, metadata: dict, content: dict = None, overwrite: bool = True):
+    """
+    Atomically write the metadata header and content as a single document file
+    
+    With overwrite=False an existing document file is left in place and
+    FileExistsError is raised instead.
+    """
+    header = orjson.dumps(metadata)
+    if len(header) > METADATA_HEADER_SIZE:
+        raise Exception("Document metadata too large")
+    
+    # Pad with whitespace so the header parses as JSON without knowing its length
+    data = header.ljust(METADATA_HEADER_SIZE)
+    if content is not None:
+        data += _encode_content(content)
+    
+    # Write to a temp file and rename over the target so readers never see a partial file
+    document_path = get_document_path(document_id)
+    # The temp name is unique per process so concurrent workers never share it
+    tmp_path = f"{document_path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        
+        if overwrite:
+            os.replace(tmp_path, document_path)
+        else:
+            # Hard-linking fails if the target exists, unlike os.replace
+            os.link(tmp_path, document_path)
+            os.unlink(tmp_path)
+    except Exception:
+        # Don't leave a partial temp file behind when the disk fills or the rename fails
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    _invalidate_listing()
+
+def save_document(document_id: str, filename: str, file_size: int, content: dict):
+    """Save document metadata and extracted content"""
     metadata = {
         "document_id": document_id,
         "filename": filename,
-        "upload_date": datetime.now().isoformat(),
+        "upload_epoch_ns": time.time_ns(),
         "file_size": file_size
     }
-    with open(get_metadata_path(document_id), 'w') as f:
-        json.dump(metadata, f, indent=2)
+    _write_document(document_id, metadata, content)
+
+def format_upload_date(metadata: dict):
+    """Get a document's upload time as an ISO string for API responses"""
+    upload_epoch_ns = metadata.get("upload_epoch_ns")
+    if upload_epoch_ns is None:
+        # Documents saved before epoch timestamps store the ISO string directly
+        return metadata.get("upload_date")
+    return datetime.fromtimestamp(upload_epoch_ns / 1e9).isoformat()
+
+def _read_metadata(document_id: str, path: str, stat_result: os.stat_result):
+    """Return a document's metadata, re-reading the header only if the file changed since it was cached"""
+    cached = _META_CACHE.get(document_id)
+    if cached is not None and cached[0] == stat_result.st_mtime_ns:
+        return cached[1]
+    
+    # Only the metadata header is read, never the content
+    with open(path, 'rb') as f:
+        metadata = orjson.loads(f.read(METADATA_HEADER_SIZE))
+    _META_CACHE[document_id] = (stat_result.st_mtime_ns, metadata)
+    return metadata
 
 def load_document_metadata(document_id: str):
     """Load document metadata"""
-    metadata_path = get_metadata_path(document_id)
-    if os.path.exists(metadata_path):
-        with open(metadata_path, 'r') as f:
-            return json.load(f)
-    return None
-
-def save_document_content(document_id: str, content: dict):
-    """Save extracted document content"""
-    with open(get_content_path(document_id), 'w') as f:
-        json.dump(content, f, indent=2)
+    document_path = get_document_path(document_id)
+    try:
+        return _read_metadata(document_id, document_path, os.stat(document_path))
+    except FileNotFoundError:
+        # Another worker may have deleted it; don't keep its metadata around
+        _META_CACHE.pop(document_id, None)
+        return None
 
 def load_document_content(document_id: str):
     """Load extracted document content"""
-    content_path = get_content_path(document_id)
-    if os.path.exists(content_path):
-        with open(content_path, 'r') as f:
-            return json.load(f)
-    return None
+    try:
+        with open(get_document_path(document_id), 'rb') as f:
+            f.seek(METADATA_HEADER_SIZE)
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    # Metadata may have been written without any content yet
+    return _decode_content(data) if data else None
+
+def load_document_excerpt(document_id: str):
+    """Load the leading MAX_DOCUMENT_CHARS of a document's text, the part sent to the LLM (cached per document)"""
+    document_path = get_document_path(document_id)
+    try:
+        # Validate on every call so deletes and rewrites by other workers are seen
+        mtime_ns = os.stat(document_path).st_mtime_ns
+    except FileNotFoundError:
+        _EXCERPT_CACHE.pop(document_id, None)
+        return None
+    
+    cached = _EXCERPT_CACHE.get(document_id)
+    if cached is not None and cached[0] == mtime_ns:
+        _EXCERPT_CACHE.move_to_end(document_id)
+        return cached[1]
+    
+    content_data = load_document_content(document_id)
+    if content_data is None:
+        return None
+    
+    content = content_data.get("content", "")
+    if isinstance(content, dict):
+        # ZIP documents stored before upload-time flattening keep per-file contents
+        content = "\n\n".join(
+            [f"--- {filename} ---\n{file_content}" 
+             for filename, file_content in content.items()]
+        )
+    
+    # Only the prompt-sized prefix is kept, so memory stays bounded per entry
+    excerpt = content[:MAX_DOCUMENT_CHARS]
+    _EXCERPT_CACHE[document_id] = (mtime_ns, excerpt)
+    _EXCERPT_CACHE.move_to_end(document_id)
+    if len(_EXCERPT_CACHE) > DOCUMENT_CACHE_SIZE:
+        _EXCERPT_CACHE.popitem(last=False)
+    return excerpt
+
+def _load_metadata_entry(entry: os.DirEntry):
+    """Load metadata for a scanned document file, or None if it was deleted meanwhile"""
+    try:
+        # DirEntry caches its stat result, so each file is stat'ed at most once
+        return _read_metadata(entry.name[:-len(DOCUMENT_FILE_SUFFIX)], entry.path, entry.stat())
+    except FileNotFoundError:
+        return None
+
+def _iter_metadata(document_entries: list):
+    """Yield metadata for each entry in order, reading at most a small window ahead of the consumer"""
+    # Overlap file reads across threads once there are enough files to pay for the pool
+    if len(document_entries) <= PARALLEL_LISTING_MIN_FILES:
+        yield from map(_load_metadata_entry, document_entries)
+        return
+    
+    max_workers = os.cpu_count() or 1
+    window = 2 * max_workers
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    remaining = iter(document_entries)
+    try:
+        # Submitting everything up front would read every header even when the
+        # caller only wants one page, so keep a bounded number of reads in flight
+        for entry in islice(remaining, window):
+            pending.append(executor.submit(_load_metadata_entry, entry))
+        while pending:
+            metadata = pending.popleft().result()
+            for entry in islice(remaining, 1):
+                pending.append(executor.submit(_load_metadata_entry, entry))
+            yield metadata
+    finally:
+        # Skip reads nobody will consume when the caller stops early
+        executor.shutdown(cancel_futures=True)
 
 def list_all_documents():
-    """List all uploaded documents"""
+    """Yield metadata for all uploaded documents, reading files only as they are consumed"""
+    global _list_cache
+    # Uploads and deletes from other worker processes show up in the folder's
+    # mtime, but directory mtimes are coarse (one clock tick on Linux), so the
+    # set of document file names is compared as well. Scanning names is cheap;
+    # only reading the headers is worth caching.
+    folder_mtime_ns = os.stat(DOCUMENTS_STORAGE_FOLDER).st_mtime_ns
+    with os.scandir(DOCUMENTS_STORAGE_FOLDER) as entries:
+        document_entries = [entry for entry in entries if entry.name.endswith(DOCUMENT_FILE_SUFFIX)]
+    
+    cache_key = (folder_mtime_ns, frozenset(entry.name for entry in document_entries), _generation)
+    if _list_cache is not None and _list_cache[0] == cache_key:
+        yield from _list_cache[1]
+        return
+    
+    # Documents deleted by other workers never pass through delete_document
+    # here, so drop their cached metadata whenever the listing is rebuilt
+    document_ids = {entry.name[:-len(DOCUMENT_FILE_SUFFIX)] for entry in document_entries}
+    for document_id in _META_CACHE.keys() - document_ids:
+        _META_CACHE.pop(document_id, None)
+    
     documents = []
-    for filename in os.listdir(DOCUMENTS_STORAGE_FOLDER):
-        if filename.endswith("_metadata.json"):
-            metadata_path = os.path.join(DOCUMENTS_STORAGE_FOLDER, filename)
-            with open(metadata_path, 'r') as f:
-                metadata = json.load(f)
-                documents.append(metadata)
-    return documents
+    for metadata in _iter_metadata(document_entries):
+        if metadata is None:
+            continue
+        documents.append(metadata)
+        yield metadata
+    
+    # Only a fully consumed listing is complete enough to cache
+    _list_cache = (cache_key, documents)
+
+def count_documents():
+    """Count stored documents from directory entries alone, without reading any file"""
+    with os.scandir(DOCUMENTS_STORAGE_FOLDER) as entries:
+        return sum(1 for entry in entries if entry.name.endswith(DOCUMENT_FILE_SUFFIX))
 
 def delete_document(document_id: str):
     """Delete document and its metadata"""
-    metadata_path = get_metadata_path(document_id)
-    content_path = get_content_path(document_id)
+    try:
+        os.unlink(get_document_path(document_id))
+    except FileNotFoundError:
+        pass
+    
+    # Drop cached data so a deleted document cannot still be listed or queried
+    _META_CACHE.pop(document_id, None)
+    _invalidate_listing()
+    _EXCERPT_CACHE.pop(document_id, None)
+
+def _migrate_legacy_document(document_id: str):
+    """Convert one legacy document, removing its old files only once the new file exists"""
+    metadata_path = os.path.join(DOCUMENTS_STORAGE_FOLDER, f"{document_id}_metadata.json")
+    content_path = os.path.join(DOCUMENTS_STORAGE_FOLDER, f"{document_id}_content.json")
+    
+    try:
+        with open(metadata_path, 'rb') as f:
+            metadata = orjson.loads(f.read())
+    except FileNotFoundError:
+        return
+    try:
+        with open(content_path, 'rb') as f:
+            content = orjson.loads(f.read())
+    except FileNotFoundError:
+        content = None
+    
+    # Never overwrite: if another worker already wrote this document (and
+    # removed the content file we then failed to find), its copy is complete
+    try:
+        _write_document(document_id, metadata, content, overwrite=False)
+    except FileExistsError:
+        pass
+    
+    for legacy_path in (content_path, metadata_path):
+        try:
+            os.unlink(legacy_path)
+        except FileNotFoundError:
+            pass
+
+def migrate_legacy_documents():
+    """Convert documents stored as separate _metadata.json/_content.json files to the single-file layout"""
+    with os.scandir(DOCUMENTS_STORAGE_FOLDER) as entries:
+        document_ids = [entry.name[:-len("_metadata.json")] for entry in entries
+                        if entry.name.endswith("_metadata.json")]
     
-    if os.path.exists(metadata_path):
-        os.remove(metadata_path)
-    if os.path.exists(content_path):
-        os.remove(content_path)
\ No newline at end of file
+    # Every worker runs this at startup, so another process may migrate or
+    # remove any of these files concurrently
+    for document_id in document_ids:
+        try:
+            _migrate_legacy_document(document_id)
+        except Exception as e:
+            # One unreadable or oversized document must not stop the app from
+            # starting; its legacy files stay in place for manual recovery
+            print(f"Legacy migration failed for {document_id}: {str(e)}")